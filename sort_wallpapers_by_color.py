@@ -8,23 +8,47 @@ Detects dominant hue using HSV histogram and moves or copies files into DEST_DIR
 Defaults are set for your system:
   SOURCE_DIR = /home/azeem/Shadow/Media/Images/Wallpaper
   DEFAULT_DEST = /home/azeem/Shadow/Media/Images/Wallpaper/sorted_by_color
+
+Decoding dominates the run time. Pillow-SIMD is a drop-in replacement that speeds up
+JPEG decode and resizing on AVX2 machines:
+  pip uninstall pillow && pip install pillow-simd
 """
 import os
+import sys
 import argparse
+import logging
+import logging.handlers
 import shutil
 import csv
+import errno
+import json
+import threading
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
+import PIL
 from PIL import Image, ImageFile
 import numpy as np
-import colorsys
+
+try:
+    from numba import njit  # optional: compiles the per-pixel hue kernel
+except ImportError:
+    njit = None
+
+try:
+    from tqdm import tqdm  # optional: progress bar for the analysis phase
+except ImportError:
+    tqdm = None
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
+log = logging.getLogger(__name__)
+
 # ------------ CONFIG DEFAULTS ------------
 DEFAULT_SOURCE = "/home/azeem/Shadow/Media/Images/Wallpaper"
 DEFAULT_DEST = os.path.join(DEFAULT_SOURCE, "sorted_by_color")
 ALLOWED_EXT = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tiff"}
+ALLOWED_EXT_TUPLE = tuple(ALLOWED_EXT)  # for str.endswith
 
 # Hue ranges (degrees). Ranges are inclusive of start and exclusive of end
 COLOR_RANGES = {
@@ -40,155 +64,381 @@ COLOR_RANGES = {
 
 DEFAULT_MIN_SAT = 0.15
 DEFAULT_MIN_VAL = 0.15
-DEFAULT_RESIZE = (50, 50)
+DEFAULT_RESIZE = (32, 32)
+# box filter: every source pixel contributes to the sample (NEAREST would skip reduce() and
+# pick isolated pixels), and it's the cheapest averaging filter after draft()/reduce()
+RESAMPLE = Image.BOX
 NUM_BINS = 36  # 10-degree bins
+CACHE_FILENAME = ".hue_cache.json"
+
+# degree -> index into COLOR_NAMES, precomputed once from COLOR_RANGES
+COLOR_NAMES = list(COLOR_RANGES) + ["other"]
+
+def _build_hue_lut():
+    lut = np.full(360, len(COLOR_NAMES) - 1, dtype=np.int8)
+    # fill in reverse so the first matching range wins, like the old linear scan
+    for idx in reversed(range(len(COLOR_RANGES))):
+        for start, end in COLOR_RANGES[COLOR_NAMES[idx]]:
+            if start <= end:
+                lut[start:end] = idx
+            else:
+                lut[start:] = idx
+                lut[:end] = idx
+    return lut
+
+HUE_LUT = _build_hue_lut()
+# same table resolved to names, so the scalar lookup is one tuple index with no numpy scalars
+HUE_NAMES = tuple(COLOR_NAMES[i] for i in HUE_LUT.tolist())
 
 # ------------ HELPERS ------------
 def is_image_file(fname):
-    _, ext = os.path.splitext(fname.lower())
-    return ext in ALLOWED_EXT
+    return fname.lower().endswith(ALLOWED_EXT_TUPLE)
+
+def warn_if_not_pillow_simd():
+    # Pillow-SIMD releases carry a ".postN" suffix, stock Pillow does not
+    if "post" not in PIL.__version__:
+        log.warning("Note: Pillow-SIMD not detected; installing pillow-simd speeds up decoding/resizing 2-4x.")
+
+def console_handler():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+def ensure_log_output():
+    # library callers that haven't configured logging still get the per-file lines and the
+    # summary on stdout, like the old print() output (the last-resort handler drops INFO)
+    if not log.hasHandlers():
+        log.addHandler(console_handler())
+        log.setLevel(logging.INFO)
 
 def safe_makedirs(path):
     os.makedirs(path, exist_ok=True)
 
-def get_unique_dest_path(dest_dir, filename):
+def get_unique_dest_path(dest_dir, filename, existing=None):
+    # existing: optional set of names already in dest_dir, used to skip known collisions in
+    # memory; the filesystem still confirms the final pick (case-insensitive volumes match
+    # names the set doesn't), and the chosen name is added to it
     base, ext = os.path.splitext(filename)
-    candidate = os.path.join(dest_dir, filename)
+    candidate = filename
     i = 1
-    while os.path.exists(candidate):
-        candidate = os.path.join(dest_dir, f"{base}_{i}{ext}")
+    while (existing is not None and candidate in existing) or os.path.exists(os.path.join(dest_dir, candidate)):
+        if existing is not None:
+            existing.add(candidate)
+        candidate = f"{base}_{i}{ext}"
         i += 1
-    return candidate
+    if existing is not None:
+        existing.add(candidate)
+    return os.path.join(dest_dir, candidate)
+
+def move_file(src_path, dest_path):
+    # same filesystem (the default layout): metadata-only rename; shutil.move copies across devices
+    try:
+        os.rename(src_path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src_path, dest_path)
+
+def copy_file(src_path, dest_path):
+    # copy_file_range keeps the data in the kernel and lets btrfs/xfs/nfs share extents;
+    # fall back to shutil.copy2 where it's missing or unsupported for this pair of files
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(src_path, "rb") as fsrc, open(dest_path, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            if remaining == 0:
+                shutil.copystat(src_path, dest_path)
+                return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+    shutil.copy2(src_path, dest_path)
 
 def hue_to_color_name(hue_deg):
     if hue_deg is None:
         return "neutral"
-    for name, ranges in COLOR_RANGES.items():
-        for start, end in ranges:
-            if start <= end:
-                if start <= hue_deg < end:
-                    return name
-            else:
-                if hue_deg >= start or hue_deg < end:
-                    return name
-    return "other"
+    return HUE_NAMES[int(hue_deg) % 360]
+
+def hues_to_color_names(hues):
+    # batch version of hue_to_color_name: one np.take over the whole folder
+    degrees = np.array([h if h is not None else 0.0 for h in hues], dtype=np.float64)
+    color_idx = np.take(HUE_LUT, degrees.astype(np.intp) % 360).tolist()
+    return [COLOR_NAMES[i] if h is not None else "neutral" for i, h in zip(color_idx, hues)]
 
 # ------------ COLOR ANALYSIS ------------
+# scratch buffers are per thread so analyze_image_dominant_hue stays safe to call from threads
+_BUFFERS = threading.local()
+
+def _get_weight_buffer(n):
+    buffers = getattr(_BUFFERS, "weights", None)
+    if buffers is None:
+        buffers = _BUFFERS.weights = {}
+    buf = buffers.get(n)
+    if buf is None:
+        buf = buffers[n] = np.empty(n, dtype=np.float64)
+    return buf
+
+def hue_bin_indices(pixels, cmax, delta, bins):
+    # hue bin straight from integer rgb: hue/60 = sector offset + (mid-min)/delta, so
+    # bin = (offset*delta + signed diff) * bins // (6*delta) without going through floats
+    # numerator fits int16 (< 6*255); only widen to int32 for the *bins product
+    r, g, b = (pixels[:, c].astype(np.int16) for c in range(3))
+    d = delta.astype(np.int16)
+    num = np.where(
+        cmax == pixels[:, 0],
+        g - b + 6 * d * (g < b),
+        np.where(cmax == pixels[:, 1], b - r + 2 * d, r - g + 4 * d),
+    )
+    return (num.astype(np.int32) * bins) // (6 * np.maximum(d, 1))
+
+def hue_histogram_numpy(pixels, min_sat, min_val, bins):
+    # stay in uint8: v = cmax/255 and s = delta/cmax, so thresholds compare against cmax/delta directly
+    cmax = pixels.max(axis=-1)
+    delta = cmax - pixels.min(axis=-1)
+
+    # s*v == delta/255; computed once, in place, into a buffer reused across images of the same size
+    sv = np.multiply(delta, 1.0 / 255.0, out=_get_weight_buffer(delta.shape[0]))
+    sv += 1e-6
+    mask = (delta >= min_sat * cmax) & (cmax >= min_val * 255.0)
+    if not mask.any():
+        return None
+
+    # bins are uniform, so the bin index is computed directly instead of np.histogram's searchsorted
+    idx = hue_bin_indices(pixels[mask], cmax[mask], delta[mask], bins)
+    return np.bincount(idx, weights=sv[mask], minlength=bins)
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _hue_histogram_kernel(pixels, min_sat, min_val_255, bins):
+        # same math as hue_histogram_numpy in one native pass, no temporary arrays
+        hist = np.zeros(bins, np.float64)
+        kept = 0
+        for i in range(pixels.shape[0]):
+            r = np.int32(pixels[i, 0])
+            g = np.int32(pixels[i, 1])
+            b = np.int32(pixels[i, 2])
+            mx = max(r, g, b)
+            d = mx - min(r, g, b)
+            if d < min_sat * mx or mx < min_val_255:
+                continue
+            if mx == r:
+                num = g - b + (6 * d if g < b else 0)
+            elif mx == g:
+                num = b - r + 2 * d
+            else:
+                num = r - g + 4 * d
+            hist[(num * bins) // (6 * max(d, 1))] += d / 255.0 + 1e-6
+            kept += 1
+        return hist, kept
+
+    def hue_histogram(pixels, min_sat, min_val, bins):
+        hist, kept = _hue_histogram_kernel(pixels, min_sat, min_val * 255.0, bins)
+        return hist if kept else None
+else:
+    hue_histogram = hue_histogram_numpy
+
 def analyze_image_dominant_hue(path, resize=DEFAULT_RESIZE, min_sat=DEFAULT_MIN_SAT, min_val=DEFAULT_MIN_VAL, bins=NUM_BINS):
     try:
         with Image.open(path) as im:
-            im = im.convert("RGBA")
-            im = im.convert("RGB")
-            im = im.resize(resize, Image.BILINEAR)
-            arr = np.asarray(im, dtype=np.float32) / 255.0
+            # let libjpeg downscale in the DCT domain instead of decoding full size (no-op for other formats)
+            im.draft("RGB", resize)
+            # one conversion pass for palette/alpha/grayscale sources; RGB (incl. drafted JPEG) needs none
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+            im.thumbnail(resize, RESAMPLE, reducing_gap=2.0)
+            arr = np.asarray(im, dtype=np.uint8)
     except Exception as e:
         return None, f"error_opening:{e}"
 
     pixels = arr.reshape(-1, 3)
-    # convert each pixel rgb->hsv via colorsys
-    hsv = np.array([colorsys.rgb_to_hsv(r, g, b) for (r, g, b) in pixels])
-    h = hsv[:, 0] * 360.0
-    s = hsv[:, 1]
-    v = hsv[:, 2]
-
-    mask = (s >= min_sat) & (v >= min_val)
-    if mask.sum() == 0:
-        mean_v = float(v.mean())
-        mean_s = float(s.mean())
+    hist = hue_histogram(pixels, min_sat, min_val, bins)
+    if hist is None:
+        cmax = pixels.max(axis=-1)
+        delta = cmax - pixels.min(axis=-1)
+        mean_v = float(cmax.mean()) / 255.0
+        mean_s = float((delta / np.maximum(cmax, 1)).mean())
         if mean_v < 0.12:
             return None, "too_dark"
         if mean_s < 0.08:
             return None, "low_saturation"
         return None, "no_pixels_after_filter"
 
-    weights = (s[mask] * v[mask]) + 1e-6
-    hist, bin_edges = np.histogram(h[mask], bins=bins, range=(0.0, 360.0), weights=weights)
     if hist.sum() == 0:
         return None, "empty_histogram"
 
     max_idx = int(hist.argmax())
-    bin_start = bin_edges[max_idx]
-    bin_end = bin_edges[max_idx + 1]
-    dominant_hue = float((bin_start + bin_end) / 2.0) % 360.0
+    dominant_hue = float((max_idx + 0.5) * (360.0 / bins)) % 360.0
 
     return dominant_hue, f"hist_peak_bin_{max_idx}"
 
+def _init_worker():
+    ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+def _analyze_worker(job):
+    path, resize, min_sat, min_val = job
+    return analyze_image_dominant_hue(path, resize=resize, min_sat=min_sat, min_val=min_val)
+
+# ------------ RESULT CACHE ------------
+# path -> {"mtime_ns", "size", "params", "hue", "reason"}; an entry is reused only if the
+# file is unchanged and was analyzed with the same settings
+def load_cache(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as fh:
+            cache = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def save_cache(cache_path, cache):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(cache, fh)
+    os.replace(tmp_path, cache_path)
+
+def cached_result(cache, entry, params):
+    hit = cache.get(entry.path)
+    if not hit:
+        return None
+    st = entry.stat()
+    if hit.get("mtime_ns") != st.st_mtime_ns or hit.get("size") != st.st_size or hit.get("params") != params:
+        return None
+    return hit["hue"], hit["reason"]
+
+def store_result(cache, entry, params, hue, reason):
+    st = entry.stat()
+    cache[entry.path] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "params": params, "hue": hue, "reason": reason}
+
 # ------------ MAIN PROCESS ------------
-def process_folder(src, dest, move_files=True, dry_run=True, min_sat=DEFAULT_MIN_SAT, min_val=DEFAULT_MIN_VAL, resize=DEFAULT_RESIZE, verbose=True):
+def process_folder(src, dest, move_files=True, dry_run=True, min_sat=DEFAULT_MIN_SAT, min_val=DEFAULT_MIN_VAL, resize=DEFAULT_RESIZE, verbose=True, workers=None, use_cache=True):
+    ensure_log_output()
     src = os.path.abspath(src)
     dest = os.path.abspath(dest)
     safe_makedirs(dest)
 
-    entries = [e for e in os.scandir(src) if e.is_file()]
-    total = len(entries)
-    if verbose:
-        print(f"Found {total} files in {src} (non-recursive).")
-
-    log_rows = []
     counts = Counter()
+    total = 0
     skipped = 0
     errors = 0
 
-    for entry in entries:
-        fname = entry.name
-        fpath = entry.path
-
-        if not is_image_file(fname):
-            if verbose:
-                print(f" SKIP (not image): {fname}")
-            skipped += 1
-            continue
-
-        hue, reason = analyze_image_dominant_hue(fpath, resize=resize, min_sat=min_sat, min_val=min_val)
-        color = hue_to_color_name(hue)
-
-        if hue is None and reason in ("too_dark",):
-            color = "dark"
-        elif hue is None and reason in ("low_saturation",):
-            color = "neutral"
-
-        target_dir = os.path.join(dest, color)
-        safe_makedirs(target_dir)
-        dest_path = get_unique_dest_path(target_dir, fname)
-
-        action = "DRY-RUN copy" if (dry_run and not move_files) else ("DRY-RUN move" if dry_run and move_files else ("copy" if not move_files else "move"))
-        if verbose:
-            print(f"[{action}] {fname} -> {color} (hue={hue if hue is not None else 'N/A'}, reason={reason})")
-
-        if not dry_run:
-            try:
-                if move_files:
-                    shutil.move(fpath, dest_path)
-                else:
-                    shutil.copy2(fpath, dest_path)
-            except Exception as e:
-                print(f"  ERROR moving/copying {fname}: {e}")
-                errors += 1
-                log_rows.append((fpath, color, "", "error", str(e)))
+    # single streaming pass over the directory; only image entries are kept
+    images = []
+    with os.scandir(src) as it:
+        for entry in it:
+            if not entry.is_file():
                 continue
-
-        counts[color] += 1
-        log_rows.append((fpath, color, dest_path if not dry_run else dest_path, "ok" if not dry_run else "dry-run", reason))
-
+            total += 1
+            if not is_image_file(entry.name):
+                if verbose:
+                    log.info(f" SKIP (not image): {entry.name}")
+                skipped += 1
+                continue
+            images.append(entry)
+    if verbose:
+        log.info(f"Found {total} files in {src} (non-recursive).")
+
+    cache_path = os.path.join(dest, CACHE_FILENAME)
+    cache = load_cache(cache_path) if use_cache else {}
+    # only files still in the source can hit again; drop entries for anything else
+    live_paths = {entry.path for entry in images}
+    cache_dirty = False
+    for path in [path for path in cache if path not in live_paths]:
+        del cache[path]
+        cache_dirty = True
+    params = [resize[0], resize[1], min_sat, min_val, int(RESAMPLE)]
+    results = [cached_result(cache, entry, params) for entry in images]
+    misses = [i for i, res in enumerate(results) if res is None]
+    if verbose and use_cache:
+        log.info(f"Cache: {len(images) - len(misses)} hits, {len(misses)} to analyze.")
+
+    # phase 1: decode + analyze in parallel (CPU-bound, independent per image)
+    if misses:
+        jobs = [(images[i].path, resize, min_sat, min_val) for i in misses]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker) as executor:
+            analyzed = executor.map(_analyze_worker, jobs, chunksize=8)
+            if verbose and tqdm is not None:
+                analyzed = tqdm(analyzed, total=len(jobs), desc="Analyzing", unit="img")
+            for i, (hue, reason) in zip(misses, analyzed):
+                results[i] = (hue, reason)
+                # open errors may be transient (file still being written), so don't cache them
+                if use_cache and not reason.startswith("error_opening"):
+                    store_result(cache, images[i], params, hue, reason)
+                    cache_dirty = True
+
+    # rows are streamed to the log as they are produced, through a large write buffer
     log_file = os.path.join(dest, "sort_log.csv")
     try:
-        with open(log_file, "w", newline="", encoding="utf-8") as fh:
-            writer = csv.writer(fh)
-            writer.writerow(["source", "assigned_color", "destination", "status", "reason"])
-            writer.writerows(log_rows)
-    except Exception as e:
-        print(f"Failed to write log: {e}")
-
-    print()
-    print("=== Summary ===")
-    print(f"Total files encountered: {total}")
-    print(f"Images processed: {sum(counts.values())}")
-    print(f"Skipped (non-image): {skipped}")
-    print(f"Errors: {errors}")
-    print("Assigned counts by color:")
+        log_fh = open(log_file, "w", newline="", encoding="utf-8", buffering=1 << 20)
+    except OSError as e:
+        # keep sorting even if the log can't be written, as before
+        log.error(f"Failed to write log: {e}")
+        log_fh = open(os.devnull, "w", newline="", encoding="utf-8")
+
+    with log_fh:
+        writer = csv.writer(log_fh)
+        writer.writerow(["source", "assigned_color", "destination", "status", "reason"])
+
+        # phase 2: filesystem moves stay serial so get_unique_dest_path can't race
+        dest_names = {}  # target_dir -> names already there, listed once per folder
+        colors = hues_to_color_names([hue for hue, _ in results])
+        for entry, (hue, reason), color in zip(images, results, colors):
+            fname = entry.name
+            fpath = entry.path
+
+            if hue is None and reason in ("too_dark",):
+                color = "dark"
+            elif hue is None and reason in ("low_saturation",):
+                color = "neutral"
+
+            target_dir = os.path.join(dest, color)
+            existing = dest_names.get(target_dir)
+            if existing is None:
+                safe_makedirs(target_dir)
+                existing = dest_names[target_dir] = set(os.listdir(target_dir))
+            dest_path = get_unique_dest_path(target_dir, fname, existing)
+
+            action = "DRY-RUN copy" if (dry_run and not move_files) else ("DRY-RUN move" if dry_run and move_files else ("copy" if not move_files else "move"))
+            if verbose:
+                log.info(f"[{action}] {fname} -> {color} (hue={hue if hue is not None else 'N/A'}, reason={reason})")
+
+            if not dry_run:
+                try:
+                    if move_files:
+                        move_file(fpath, dest_path)
+                        # the source path is gone, so its cache entry can never hit again
+                        if cache.pop(fpath, None) is not None:
+                            cache_dirty = True
+                    else:
+                        copy_file(fpath, dest_path)
+                except Exception as e:
+                    log.error(f"  ERROR moving/copying {fname}: {e}")
+                    errors += 1
+                    writer.writerow((fpath, color, "", "error", str(e)))
+                    continue
+
+            counts[color] += 1
+            writer.writerow((fpath, color, dest_path if not dry_run else dest_path, "ok" if not dry_run else "dry-run", reason))
+
+    if use_cache and cache_dirty:
+        try:
+            save_cache(cache_path, cache)
+        except OSError as e:
+            log.error(f"Failed to write cache: {e}")
+
+    log.info("")
+    log.info("=== Summary ===")
+    log.info(f"Total files encountered: {total}")
+    log.info(f"Images processed: {sum(counts.values())}")
+    log.info(f"Skipped (non-image): {skipped}")
+    log.info(f"Errors: {errors}")
+    log.info("Assigned counts by color:")
     for k, v in counts.most_common():
-        print(f"  {k}: {v}")
-    print(f"Log written to: {log_file}")
+        log.info(f"  {k}: {v}")
+    log.info(f"Log written to: {log_file}")
     return counts, log_file
 
 # ------------ CLI ------------
@@ -204,24 +454,42 @@ def parse_args():
     p.add_argument("--min-val", type=float, default=DEFAULT_MIN_VAL)
     p.add_argument("--resize", type=int, nargs=2, metavar=("W", "H"), default=list(DEFAULT_RESIZE))
     p.add_argument("--verbose", action="store_true", default=True)
+    p.add_argument("--no-cache", dest="use_cache", action="store_false", help="Ignore and don't update the analysis cache in the destination folder.")
+    p.add_argument("--workers", type=int, default=None, help="Worker processes for image analysis (default: CPU count).")
     return p.parse_args()
 
+def setup_logging():
+    # per-file lines are buffered and written 100 at a time; errors flush immediately
+    console = console_handler()
+    buffered = logging.handlers.MemoryHandler(100, flushLevel=logging.ERROR, target=console)
+    log.addHandler(buffered)
+    log.setLevel(logging.INFO)
+    return buffered
+
 def main():
     args = parse_args()
+    handler = setup_logging()
+    if args.verbose:
+        warn_if_not_pillow_simd()
     move_files = args.move and not args.copy
     if not args.move and not args.copy:
         move_files = True
 
-    process_folder(
-        src=args.src,
-        dest=args.dest,
-        move_files=move_files,
-        dry_run=args.dry_run,
-        min_sat=args.min_sat,
-        min_val=args.min_val,
-        resize=tuple(args.resize),
-        verbose=args.verbose,
-    )
+    try:
+        process_folder(
+            src=args.src,
+            dest=args.dest,
+            move_files=move_files,
+            dry_run=args.dry_run,
+            min_sat=args.min_sat,
+            min_val=args.min_val,
+            resize=tuple(args.resize),
+            verbose=args.verbose,
+            workers=args.workers,
+            use_cache=args.use_cache,
+        )
+    finally:
+        handler.close()
 
 if __name__ == "__main__":
     main()